@@ -3,39 +3,66 @@ NAV Erosion Tracker - Flask Web Application
 Track covered call ETF NAV erosion with alerts.
 """
 
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 import csv
 import io
-from datetime import datetime
+import zlib
+from datetime import date
+
+try:
+    import orjson
+except ImportError:  # Fall back to Flask's stdlib json provider
+    orjson = None
 
 import database as db
 import fetcher
 import calculator
 
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson; used for jsonify() and the |tojson filter."""
+
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        option = self.options
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
 app.secret_key = 'nav-erosion-tracker-secret-key-change-in-production'
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 
+app.teardown_appcontext(db.close_db)
 
-@app.before_request
-def before_request():
-    """Initialize database before first request."""
-    db.init_db()
+# Create tables and indexes once at startup rather than on every request
+db.init_db()
 
 
 @app.route('/')
 def dashboard():
     """Main dashboard with scorecard of all tracked ETFs."""
-    etf_data = db.get_all_latest_metrics()
+    etf_data = db.get_all_latest_metrics_cached()
 
     # Check for alerts
-    alerts = []
-    for item in etf_data:
-        if item['metrics'] and item['metrics']['flag'] != 'OK':
-            alerts.append({
-                'etf': item['etf'],
-                'flag': item['metrics']['flag'],
-                'nav_erosion': item['metrics']['nav_erosion_pct']
-            })
+    alerts = [
+        {
+            'etf': item['etf'],
+            'flag': metrics['flag'],
+            'nav_erosion': metrics['nav_erosion_pct']
+        }
+        for item in etf_data
+        if (metrics := item['metrics']) and metrics['flag'] != 'OK'
+    ]
 
     return render_template('dashboard.html',
                            etf_data=etf_data,
@@ -54,7 +81,7 @@ def etf_detail(etf_id):
     # Get metrics and snapshots
     metrics = db.get_latest_metrics(etf_id)
     metrics_history = db.get_metrics_history(etf_id, limit=12)
-    snapshots = db.get_etf_snapshots(etf_id)
+    snapshots = db.get_etf_snapshots(etf_id, ascending=True)
 
     # Generate monthly breakdown
     monthly_data = [
@@ -64,14 +91,14 @@ def etf_detail(etf_id):
             'close_price': s['close_price'],
             'distribution': s['distribution']
         }
-        for s in reversed(snapshots)  # Oldest first
+        for s in snapshots
     ]
-    breakdown = calculator.generate_monthly_breakdown(monthly_data)
+    breakdown = calculator.generate_monthly_breakdown(monthly_data, presorted=True)
 
     # Prepare chart data
-    chart_dates = [s['snapshot_date'] for s in reversed(snapshots)]
-    chart_prices = [s['close_price'] for s in reversed(snapshots)]
-    chart_distributions = [s['distribution'] for s in reversed(snapshots)]
+    chart_dates = [m['date'] for m in monthly_data]
+    chart_prices = [m['close_price'] for m in monthly_data]
+    chart_distributions = [m['distribution'] for m in monthly_data]
 
     # Erosion trend from metrics history
     erosion_dates = [m['calc_date'] for m in reversed(metrics_history)]
@@ -101,7 +128,7 @@ def add_etf():
             return render_template('add_etf.html')
 
         # Validate ticker with Yahoo Finance
-        info = fetcher.fetch_etf_info(ticker)
+        info = _fetch_or_error(fetcher.fetch_etf_info, ticker, include_name=not name)
         if not info['success']:
             flash(f'Invalid ticker: {info["error"]}', 'danger')
             return render_template('add_etf.html', ticker=ticker, name=name)
@@ -141,8 +168,18 @@ def refresh_all():
     success_count = 0
     error_count = 0
 
+    # Fetch every ticker with batched downloads, then save each ETF
+    tickers = [etf['ticker'] for etf in etfs]
+    try:
+        monthly = fetcher.get_monthly_data_many(tickers)
+    except Exception as e:
+        app.logger.exception('Unexpected error refreshing %d ETFs', len(tickers))
+        monthly = dict.fromkeys(tickers, {'success': False, 'error': str(e)})
+
+    # One calc_date for the whole refresh
+    today = date.today().isoformat()
     for etf in etfs:
-        result = _refresh_etf_data(etf['id'])
+        result = _save_etf_data(etf, monthly[etf['ticker']], today)
         if result['success']:
             success_count += 1
         else:
@@ -179,32 +216,47 @@ def _refresh_etf_data(etf_id):
     if not etf:
         return {'success': False, 'error': 'ETF not found', 'etf_name': None}
 
-    # Fetch data from Yahoo Finance
-    data = fetcher.get_monthly_data(etf['ticker'])
+    # Fetch data from Yahoo Finance, bypassing cached results since this is
+    # an explicit refresh
+    data = _fetch_or_error(fetcher.get_monthly_data, etf['ticker'], fresh=True)
+    return _save_etf_data(etf, data, date.today().isoformat())
 
-    if not data['success']:
-        return {'success': False, 'error': data['error'], 'etf_name': etf['name']}
 
-    # Clear old data and save new snapshots
-    db.clear_etf_data(etf_id)
+def _fetch_or_error(fetch, *args, **kwargs):
+    """
+    Call a fetcher function, turning unexpected errors into an error result.
+
+    The fetchers only catch known Yahoo failures; anything else is logged
+    with its traceback and reported to the user instead of raising a 500.
+    """
+    try:
+        return fetch(*args, **kwargs)
+    except Exception as e:
+        app.logger.exception('Unexpected error in %s%r', fetch.__name__, args)
+        return {'success': False, 'error': str(e)}
 
-    for month in data['monthly_data']:
-        db.save_snapshot(
-            etf_id,
-            month['date'],
-            month['close_price'],
-            month['distribution']
-        )
 
-    # Calculate and save metrics
+def _save_etf_data(etf, data, today):
+    """Save fetched monthly data and metrics calculated as of `today` (ISO date) for an ETF."""
+    etf_id = etf['id']
+    if not data['success']:
+        return {'success': False, 'error': data['error'], 'etf_name': etf['name']}
+
+    # Calculate metrics (fetcher returns months in ascending order)
     metrics = calculator.calculate_metrics(
         data['monthly_data'],
         etf['warn_threshold'],
-        etf['sell_threshold']
+        etf['sell_threshold'],
+        presorted=True,
+        today=today
     )
 
-    if metrics:
-        db.save_metrics(etf_id, metrics)
+    # Replace old snapshots and metrics in one transaction
+    db.replace_etf_data(
+        etf_id,
+        [(m['date'], m['close_price'], m['distribution']) for m in data['monthly_data']],
+        metrics
+    )
 
     return {'success': True, 'error': None, 'etf_name': etf['name']}
 
@@ -252,39 +304,56 @@ def update_etf_settings(etf_id):
 
 @app.route('/export')
 def export_csv():
-    """Export all historical data to CSV."""
-    output = io.StringIO()
-    writer = csv.writer(output)
+    """Export all historical data to CSV, streamed row by row."""
+    def generate():
+        line = io.StringIO()
+        writer = csv.writer(line)
+
+        def render(fields):
+            line.seek(0)
+            line.truncate()
+            writer.writerow(fields)
+            return line.getvalue()
+
+        # Header
+        yield render([
+            'ETF', 'Ticker', 'Date', 'Close Price', 'Distribution',
+            'NAV Erosion %', 'True Return %', 'Flag'
+        ])
+
+        for row in db.iter_export_rows():
+            has_metrics = row['flag'] is not None
+            yield render([
+                row['name'],
+                row['ticker'],
+                row['snapshot_date'],
+                f"{row['close_price']:.2f}",
+                f"{row['distribution']:.4f}",
+                f"{row['nav_erosion_pct'] * 100:.2f}" if has_metrics else '',
+                f"{row['true_return_pct'] * 100:.2f}" if has_metrics else '',
+                row['flag'] if has_metrics else ''
+            ])
 
-    # Header
-    writer.writerow([
-        'ETF', 'Ticker', 'Date', 'Close Price', 'Distribution',
-        'NAV Erosion %', 'True Return %', 'Flag'
-    ])
+    headers = {
+        'Content-Disposition': f'attachment;filename=nav_erosion_export_{date.today().strftime("%Y%m%d")}.csv',
+        'Vary': 'Accept-Encoding'
+    }
+    body = generate()
+    if request.accept_encodings['gzip']:
+        body = _gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
 
-    etfs = db.get_all_etfs()
-    for etf in etfs:
-        snapshots = db.get_etf_snapshots(etf['id'])
-        metrics = db.get_latest_metrics(etf['id'])
-
-        for snapshot in snapshots:
-            writer.writerow([
-                etf['name'],
-                etf['ticker'],
-                snapshot['snapshot_date'],
-                f"{snapshot['close_price']:.2f}",
-                f"{snapshot['distribution']:.4f}",
-                f"{metrics['nav_erosion_pct'] * 100:.2f}" if metrics else '',
-                f"{metrics['true_return_pct'] * 100:.2f}" if metrics else '',
-                metrics['flag'] if metrics else ''
-            ])
+    return Response(stream_with_context(body), mimetype='text/csv', headers=headers)
 
-    output.seek(0)
-    return Response(
-        output.getvalue(),
-        mimetype='text/csv',
-        headers={'Content-Disposition': f'attachment;filename=nav_erosion_export_{datetime.now().strftime("%Y%m%d")}.csv'}
-    )
+
+def _gzip_stream(chunks):
+    """Gzip-compress an iterable of text chunks, yielding compressed bytes."""
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
 
 
 @app.route('/api/etf/<int:etf_id>/metrics')
@@ -296,8 +365,8 @@ def api_etf_metrics(etf_id):
 
     metrics = db.get_latest_metrics(etf_id)
     return jsonify({
-        'etf': etf,
-        'metrics': metrics
+        'etf': dict(etf),
+        'metrics': dict(metrics) if metrics else None
     })
 
 
@@ -3,7 +3,9 @@ NAV Erosion calculations for covered call ETFs.
 Implements the core metrics: NAV erosion %, true return %, and flag determination.
 """
 
-from datetime import datetime
+from datetime import date
+
+import numpy as np
 
 
 def calculate_nav_erosion(start_price, end_price):
@@ -51,7 +53,8 @@ def get_flag(nav_erosion_pct, warn_threshold=-0.06, sell_threshold=-0.10):
     return 'OK'
 
 
-def calculate_metrics(monthly_data, warn_threshold=-0.06, sell_threshold=-0.10):
+def calculate_metrics(monthly_data, warn_threshold=-0.06, sell_threshold=-0.10, presorted=False,
+                      today=None):
     """
     Calculate all metrics from monthly data.
 
@@ -59,6 +62,8 @@ def calculate_metrics(monthly_data, warn_threshold=-0.06, sell_threshold=-0.10):
         monthly_data: List of dicts with 'date', 'close_price', 'distribution'
         warn_threshold: Threshold for WARNING flag
         sell_threshold: Threshold for SELL flag
+        presorted: True if monthly_data is already in ascending date order
+        today: ISO date string used as calc_date (default: today's date)
 
     Returns:
         dict with all calculated metrics
@@ -67,18 +72,20 @@ def calculate_metrics(monthly_data, warn_threshold=-0.06, sell_threshold=-0.10):
         return None
 
     # Sort by date to ensure correct order
-    sorted_data = sorted(monthly_data, key=lambda x: x['date'])
+    sorted_data = monthly_data if presorted else sorted(monthly_data, key=lambda x: x['date'])
 
-    start_price = sorted_data[0]['close_price']
-    end_price = sorted_data[-1]['close_price']
-    total_distributions = sum(d['distribution'] for d in sorted_data)
+    start_price = float(sorted_data[0]['close_price'])
+    end_price = float(sorted_data[-1]['close_price'])
+    total_distributions = float(np.fromiter(
+        (d['distribution'] for d in sorted_data), dtype=np.float64, count=len(sorted_data)
+    ).sum())
 
     nav_erosion_pct = calculate_nav_erosion(start_price, end_price)
     true_return_pct = calculate_true_return(start_price, end_price, total_distributions)
     flag = get_flag(nav_erosion_pct, warn_threshold, sell_threshold)
 
     return {
-        'calc_date': datetime.now().strftime('%Y-%m-%d'),
+        'calc_date': today or date.today().isoformat(),
         'window_start': sorted_data[0]['date'],
         'window_end': sorted_data[-1]['date'],
         'start_price': start_price,
@@ -90,7 +97,7 @@ def calculate_metrics(monthly_data, warn_threshold=-0.06, sell_threshold=-0.10):
     }
 
 
-def generate_monthly_breakdown(monthly_data):
+def generate_monthly_breakdown(monthly_data, presorted=False):
     """
     Generate a monthly breakdown table with cumulative erosion.
 
@@ -99,37 +106,52 @@ def generate_monthly_breakdown(monthly_data):
         - close_price
         - distribution
         - cumulative_erosion_pct
+
+    Pass presorted=True when monthly_data is already in ascending date order.
     """
     if not monthly_data:
         return []
 
-    sorted_data = sorted(monthly_data, key=lambda x: x['date'])
-    start_price = sorted_data[0]['close_price']
+    sorted_data = monthly_data if presorted else sorted(monthly_data, key=lambda x: x['date'])
+    prices = np.fromiter(
+        (d['close_price'] for d in sorted_data), dtype=np.float64, count=len(sorted_data)
+    )
+    start_price = prices[0]
+    if start_price <= 0:
+        cumulative = [0.0] * len(prices)
+    else:
+        cumulative = _breakdown_kernel(prices, start_price).tolist()
 
-    breakdown = []
-    for data in sorted_data:
-        cumulative_erosion = calculate_nav_erosion(start_price, data['close_price'])
-        breakdown.append({
+    return [
+        {
             'month': data.get('year_month', data['date'][:7]),
             'date': data['date'],
             'close_price': data['close_price'],
             'distribution': data['distribution'],
             'cumulative_erosion_pct': cumulative_erosion
-        })
+        }
+        for data, cumulative_erosion in zip(sorted_data, cumulative)
+    ]
+
 
-    return breakdown
+def _breakdown_kernel(prices, start_price):
+    """Cumulative erosion of every price relative to start_price, as a float64 array."""
+    out = np.subtract(prices, start_price)
+    out /= start_price
+    return out
 
 
-def calculate_distribution_yield(monthly_data):
+def calculate_distribution_yield(monthly_data, presorted=False):
     """
     Calculate annualized distribution yield.
 
     Uses average monthly distribution and latest price.
+    Pass presorted=True when monthly_data is already in ascending date order.
     """
     if not monthly_data:
         return 0
 
-    sorted_data = sorted(monthly_data, key=lambda x: x['date'])
+    sorted_data = monthly_data if presorted else sorted(monthly_data, key=lambda x: x['date'])
     total_distributions = sum(d['distribution'] for d in sorted_data)
     months = len(sorted_data)
     current_price = sorted_data[-1]['close_price']
@@ -5,17 +5,168 @@ Uses SQLite for simplicity - no installation required.
 
 import sqlite3
 import os
-from datetime import datetime
+import json
+import time
+from datetime import date
 from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_app_context
 
 DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'data', 'tracker.db')
 
+# Per-connection tuning; journal_mode is persisted in the database file
+CONNECTION_PRAGMAS = '''
+    PRAGMA synchronous = NORMAL;
+    PRAGMA temp_store = MEMORY;
+    PRAGMA cache_size = -20000;
+    PRAGMA mmap_size = 268435456;
+'''
+
+_wal_enabled = False
+
+# Seconds a cached dashboard result may be served even without local writes
+LATEST_METRICS_CACHE_TTL = 30
+
+# Bumped by every write helper; cached reads are only valid for one version
+_data_version = 0
+_latest_metrics_cache = {'version': None, 'expires': 0.0, 'value': None}
+
+METRICS_COLUMNS = (
+    'id', 'etf_id', 'calc_date', 'window_start', 'window_end',
+    'start_price', 'end_price', 'total_distributions',
+    'nav_erosion_pct', 'true_return_pct', 'flag'
+)
+
+# Join condition selecting only the most recent metrics row for each ETF
+LATEST_METRICS_JOIN = '''
+    LEFT JOIN metrics m ON m.id = (
+        SELECT id FROM metrics WHERE etf_id = e.id
+        ORDER BY calc_date DESC LIMIT 1
+    )
+'''
+
+_METRIC_SELECT = ', '.join(f'm.{col} AS m_{col}' for col in METRICS_COLUMNS)
+
+# Statements are kept as module constants so each connection's statement
+# cache is hit by identical SQL text on every call
+SQL_INSERT_ETF = '''
+    INSERT INTO etfs (name, ticker, warn_threshold, sell_threshold, added_date)
+    VALUES (?, ?, ?, ?, ?)
+'''
+SQL_DEACTIVATE_ETF = 'UPDATE etfs SET active = 0 WHERE id = ?'
+SQL_DELETE_ETF = 'DELETE FROM etfs WHERE id = ?'
+SQL_DELETE_ETF_METRICS = 'DELETE FROM metrics WHERE etf_id = ?'
+SQL_DELETE_ETF_SNAPSHOTS = 'DELETE FROM snapshots WHERE etf_id = ?'
+SQL_GET_ACTIVE_ETFS = 'SELECT * FROM etfs WHERE active = 1 ORDER BY name'
+SQL_GET_ALL_ETFS = 'SELECT * FROM etfs ORDER BY name'
+SQL_GET_ETF = 'SELECT * FROM etfs WHERE id = ?'
+SQL_GET_ETF_BY_TICKER = 'SELECT * FROM etfs WHERE ticker = ?'
+SQL_UPDATE_ETF_THRESHOLDS = '''
+    UPDATE etfs SET warn_threshold = ?, sell_threshold = ?
+    WHERE id = ?
+'''
+
+SQL_UPSERT_SNAPSHOT = '''
+    INSERT INTO snapshots (etf_id, snapshot_date, close_price, distribution)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(etf_id, snapshot_date) DO UPDATE SET
+        close_price = excluded.close_price,
+        distribution = excluded.distribution
+'''
+SQL_PRUNE_SNAPSHOTS = '''
+    DELETE FROM snapshots
+    WHERE etf_id = ? AND snapshot_date NOT IN (SELECT value FROM json_each(?))
+'''
+SQL_GET_SNAPSHOTS = '''
+    SELECT snapshot_date, close_price, distribution FROM snapshots
+    WHERE etf_id = ? ORDER BY snapshot_date DESC
+'''
+SQL_GET_SNAPSHOTS_LIMIT = SQL_GET_SNAPSHOTS + ' LIMIT ?'
+SQL_GET_SNAPSHOTS_ASC = '''
+    SELECT snapshot_date, close_price, distribution FROM snapshots
+    WHERE etf_id = ? ORDER BY snapshot_date ASC
+'''
+SQL_GET_SNAPSHOTS_ASC_LIMIT = SQL_GET_SNAPSHOTS_ASC + ' LIMIT ?'
+SQL_GET_SNAPSHOTS_RANGE = '''
+    SELECT * FROM snapshots
+    WHERE etf_id = ? AND snapshot_date >= ? AND snapshot_date <= ?
+    ORDER BY snapshot_date ASC
+'''
+
+SQL_INSERT_METRICS = '''
+    INSERT INTO metrics (
+        etf_id, calc_date, window_start, window_end,
+        start_price, end_price, total_distributions,
+        nav_erosion_pct, true_return_pct, flag
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_GET_LATEST_METRICS = '''
+    SELECT * FROM metrics WHERE etf_id = ?
+    ORDER BY calc_date DESC LIMIT 1
+'''
+SQL_GET_METRICS_HISTORY = '''
+    SELECT * FROM metrics WHERE etf_id = ?
+    ORDER BY calc_date DESC LIMIT ?
+'''
+SQL_GET_ALL_LATEST_METRICS = f'''
+    SELECT e.*, {_METRIC_SELECT}
+    FROM etfs e
+    {LATEST_METRICS_JOIN}
+    WHERE e.active = 1
+    ORDER BY e.name
+'''
+SQL_GET_EXPORT_ROWS = f'''
+    SELECT e.name, e.ticker, s.snapshot_date, s.close_price, s.distribution,
+           m.nav_erosion_pct, m.true_return_pct, m.flag
+    FROM etfs e
+    JOIN snapshots s ON s.etf_id = e.id
+    {LATEST_METRICS_JOIN}
+    WHERE e.active = 1
+    ORDER BY e.name, e.id, s.snapshot_date DESC
+'''
+
+SQL_GET_SETTING = 'SELECT value FROM settings WHERE key = ?'
+SQL_SET_SETTING = 'INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)'
+SQL_GET_ALL_SETTINGS = 'SELECT key, value FROM settings'
+
+
+def connect():
+    """Open a new database connection with WAL mode and tuned pragmas."""
+    global _wal_enabled
+
+    conn = sqlite3.connect(DATABASE_PATH, cached_statements=256)
+    conn.row_factory = sqlite3.Row
+    if not _wal_enabled:
+        conn.execute('PRAGMA journal_mode = WAL')
+        _wal_enabled = True
+    conn.executescript(CONNECTION_PRAGMAS)
+    return conn
+
+
+def close_db(exception=None):
+    """Close the request-scoped connection, if one was opened."""
+    conn = g.pop('db', None)
+    if conn is not None:
+        conn.close()
+
 
 @contextmanager
 def get_db():
-    """Context manager for database connections."""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
+    """
+    Context manager for database connections.
+
+    Inside a Flask app context the connection is shared for the whole request
+    and closed by close_db(); elsewhere a fresh connection is opened and closed.
+    """
+    if has_app_context():
+        if 'db' not in g:
+            g.db = connect()
+        with g.db:
+            yield g.db
+        return
+
+    conn = connect()
     try:
         yield conn
         conn.commit()
@@ -23,6 +174,18 @@ def get_db():
         conn.close()
 
 
+def invalidates_cache(func):
+    """Mark a write helper so cached reads are discarded once it returns."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        global _data_version
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _data_version += 1
+    return wrapper
+
+
 def init_db():
     """Initialize database with required tables."""
     os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
@@ -82,36 +245,47 @@ def init_db():
             )
         ''')
 
+        # Indexes for latest-by-date lookups and the active ETF listing;
+        # snapshot lookups use the UNIQUE(etf_id, snapshot_date) autoindex
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_metrics_etf_date
+            ON metrics(etf_id, calc_date DESC)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_etfs_active_name
+            ON etfs(active, name)
+        ''')
 
+
+@invalidates_cache
 def add_etf(name, ticker, warn_threshold=-0.06, sell_threshold=-0.10):
     """Add a new ETF to track."""
     with get_db() as conn:
         cursor = conn.cursor()
         try:
-            cursor.execute('''
-                INSERT INTO etfs (name, ticker, warn_threshold, sell_threshold, added_date)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (name, ticker.upper(), warn_threshold, sell_threshold, datetime.now().strftime('%Y-%m-%d')))
+            cursor.execute(SQL_INSERT_ETF, (name, ticker.upper(), warn_threshold, sell_threshold, date.today().isoformat()))
             return cursor.lastrowid
         except sqlite3.IntegrityError:
             return None  # Ticker already exists
 
 
+@invalidates_cache
 def remove_etf(etf_id):
     """Remove an ETF from tracking (soft delete)."""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('UPDATE etfs SET active = 0 WHERE id = ?', (etf_id,))
+        cursor.execute(SQL_DEACTIVATE_ETF, (etf_id,))
         return cursor.rowcount > 0
 
 
+@invalidates_cache
 def delete_etf(etf_id):
     """Permanently delete an ETF and all its data."""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('DELETE FROM metrics WHERE etf_id = ?', (etf_id,))
-        cursor.execute('DELETE FROM snapshots WHERE etf_id = ?', (etf_id,))
-        cursor.execute('DELETE FROM etfs WHERE id = ?', (etf_id,))
+        cursor.execute(SQL_DELETE_ETF_METRICS, (etf_id,))
+        cursor.execute(SQL_DELETE_ETF_SNAPSHOTS, (etf_id,))
+        cursor.execute(SQL_DELETE_ETF, (etf_id,))
         return cursor.rowcount > 0
 
 
@@ -120,133 +294,164 @@ def get_all_etfs(active_only=True):
     with get_db() as conn:
         cursor = conn.cursor()
         if active_only:
-            cursor.execute('SELECT * FROM etfs WHERE active = 1 ORDER BY name')
+            cursor.execute(SQL_GET_ACTIVE_ETFS)
         else:
-            cursor.execute('SELECT * FROM etfs ORDER BY name')
-        return [dict(row) for row in cursor.fetchall()]
+            cursor.execute(SQL_GET_ALL_ETFS)
+        return cursor.fetchall()
 
 
 def get_etf(etf_id):
     """Get a single ETF by ID."""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM etfs WHERE id = ?', (etf_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        cursor.execute(SQL_GET_ETF, (etf_id,))
+        return cursor.fetchone()
 
 
 def get_etf_by_ticker(ticker):
     """Get a single ETF by ticker."""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM etfs WHERE ticker = ?', (ticker.upper(),))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        cursor.execute(SQL_GET_ETF_BY_TICKER, (ticker.upper(),))
+        return cursor.fetchone()
 
 
+@invalidates_cache
 def save_snapshot(etf_id, date, close_price, distribution=0):
     """Save a price/distribution snapshot."""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO snapshots (etf_id, snapshot_date, close_price, distribution)
-            VALUES (?, ?, ?, ?)
-        ''', (etf_id, date, close_price, distribution))
+        cursor.execute(SQL_UPSERT_SNAPSHOT, (etf_id, date, close_price, distribution))
         return cursor.lastrowid
 
 
-def get_etf_snapshots(etf_id, limit=None):
-    """Get snapshots for an ETF, ordered by date descending."""
+def _insert_snapshots(cursor, etf_id, rows):
+    """Insert snapshot rows using an existing cursor."""
+    cursor.executemany(SQL_UPSERT_SNAPSHOT, [
+        (etf_id, date, close_price, distribution)
+        for date, close_price, distribution in rows
+    ])
+
+
+def get_etf_snapshots(etf_id, limit=None, ascending=False):
+    """
+    Get snapshot_date, close_price and distribution for an ETF.
+
+    Ordered by date descending unless ascending=True; limit applies in that order.
+    """
     with get_db() as conn:
         cursor = conn.cursor()
-        query = 'SELECT * FROM snapshots WHERE etf_id = ? ORDER BY snapshot_date DESC'
+        if ascending:
+            query, limit_query = SQL_GET_SNAPSHOTS_ASC, SQL_GET_SNAPSHOTS_ASC_LIMIT
+        else:
+            query, limit_query = SQL_GET_SNAPSHOTS, SQL_GET_SNAPSHOTS_LIMIT
         if limit:
-            query += f' LIMIT {limit}'
-        cursor.execute(query, (etf_id,))
-        return [dict(row) for row in cursor.fetchall()]
+            cursor.execute(limit_query, (etf_id, limit))
+        else:
+            cursor.execute(query, (etf_id,))
+        return cursor.fetchall()
 
 
 def get_etf_snapshots_range(etf_id, start_date, end_date):
     """Get snapshots for an ETF within a date range."""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT * FROM snapshots
-            WHERE etf_id = ? AND snapshot_date >= ? AND snapshot_date <= ?
-            ORDER BY snapshot_date ASC
-        ''', (etf_id, start_date, end_date))
-        return [dict(row) for row in cursor.fetchall()]
+        cursor.execute(SQL_GET_SNAPSHOTS_RANGE, (etf_id, start_date, end_date))
+        return cursor.fetchall()
 
 
+@invalidates_cache
 def save_metrics(etf_id, metrics_dict):
     """Save calculated metrics."""
     with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO metrics (
-                etf_id, calc_date, window_start, window_end,
-                start_price, end_price, total_distributions,
-                nav_erosion_pct, true_return_pct, flag
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            etf_id,
-            metrics_dict['calc_date'],
-            metrics_dict['window_start'],
-            metrics_dict['window_end'],
-            metrics_dict['start_price'],
-            metrics_dict['end_price'],
-            metrics_dict['total_distributions'],
-            metrics_dict['nav_erosion_pct'],
-            metrics_dict['true_return_pct'],
-            metrics_dict['flag']
-        ))
-        return cursor.lastrowid
+        return _insert_metrics(conn.cursor(), etf_id, metrics_dict)
+
+
+def _insert_metrics(cursor, etf_id, metrics_dict):
+    """Insert a metrics row using an existing cursor."""
+    cursor.execute(SQL_INSERT_METRICS, (
+        etf_id,
+        metrics_dict['calc_date'],
+        metrics_dict['window_start'],
+        metrics_dict['window_end'],
+        metrics_dict['start_price'],
+        metrics_dict['end_price'],
+        metrics_dict['total_distributions'],
+        metrics_dict['nav_erosion_pct'],
+        metrics_dict['true_return_pct'],
+        metrics_dict['flag']
+    ))
+    return cursor.lastrowid
 
 
 def get_latest_metrics(etf_id):
     """Get the most recent metrics for an ETF."""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT * FROM metrics WHERE etf_id = ?
-            ORDER BY calc_date DESC LIMIT 1
-        ''', (etf_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        cursor.execute(SQL_GET_LATEST_METRICS, (etf_id,))
+        return cursor.fetchone()
 
 
 def get_metrics_history(etf_id, limit=12):
     """Get metrics history for an ETF."""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT * FROM metrics WHERE etf_id = ?
-            ORDER BY calc_date DESC LIMIT ?
-        ''', (etf_id, limit))
-        return [dict(row) for row in cursor.fetchall()]
+        cursor.execute(SQL_GET_METRICS_HISTORY, (etf_id, limit))
+        return cursor.fetchall()
 
 
 def get_all_latest_metrics():
-    """Get latest metrics for all active ETFs."""
-    etfs = get_all_etfs()
-    results = []
-    for etf in etfs:
-        metrics = get_latest_metrics(etf['id'])
-        results.append({
-            'etf': etf,
-            'metrics': metrics
-        })
-    return results
+    """Get latest metrics for all active ETFs in a single query."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(SQL_GET_ALL_LATEST_METRICS)
+        results = []
+        for row in cursor.fetchall():
+            row = dict(row)
+            metrics = {col: row.pop(f'm_{col}') for col in METRICS_COLUMNS}
+            results.append({
+                'etf': row,
+                'metrics': metrics if metrics['id'] is not None else None
+            })
+        return results
+
+
+def get_all_latest_metrics_cached():
+    """
+    Cached get_all_latest_metrics() for the dashboard.
+
+    Reused until a write helper runs or LATEST_METRICS_CACHE_TTL expires.
+    """
+    cache = _latest_metrics_cache
+    now = time.monotonic()
+    if cache['version'] == _data_version and now < cache['expires']:
+        return cache['value']
+
+    version = _data_version
+    value = get_all_latest_metrics()
+    cache.update(version=version, expires=now + LATEST_METRICS_CACHE_TTL, value=value)
+    return value
+
+
+def iter_export_rows():
+    """
+    Yield all snapshots for active ETFs joined with each ETF's latest metrics.
+
+    Rows are read from the cursor as they are consumed, so the connection
+    stays open until the generator is exhausted or closed.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(SQL_GET_EXPORT_ROWS)
+        yield from cursor
 
 
+@invalidates_cache
 def update_etf_thresholds(etf_id, warn_threshold, sell_threshold):
     """Update thresholds for an ETF."""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE etfs SET warn_threshold = ?, sell_threshold = ?
-            WHERE id = ?
-        ''', (warn_threshold, sell_threshold, etf_id))
+        cursor.execute(SQL_UPDATE_ETF_THRESHOLDS, (warn_threshold, sell_threshold, etf_id))
         return cursor.rowcount > 0
 
 
@@ -254,7 +459,7 @@ def get_setting(key, default=None):
     """Get a setting value."""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT value FROM settings WHERE key = ?', (key,))
+        cursor.execute(SQL_GET_SETTING, (key,))
         row = cursor.fetchone()
         return row['value'] if row else default
 
@@ -263,22 +468,38 @@ def set_setting(key, value):
     """Set a setting value."""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)
-        ''', (key, str(value)))
+        cursor.execute(SQL_SET_SETTING, (key, str(value)))
 
 
 def get_all_settings():
     """Get all settings as a dictionary."""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT key, value FROM settings')
+        cursor.execute(SQL_GET_ALL_SETTINGS)
         return {row['key']: row['value'] for row in cursor.fetchall()}
 
 
+@invalidates_cache
 def clear_etf_data(etf_id):
     """Clear all snapshots and metrics for an ETF (for re-fetching)."""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('DELETE FROM metrics WHERE etf_id = ?', (etf_id,))
-        cursor.execute('DELETE FROM snapshots WHERE etf_id = ?', (etf_id,))
+        cursor.execute(SQL_DELETE_ETF_METRICS, (etf_id,))
+        cursor.execute(SQL_DELETE_ETF_SNAPSHOTS, (etf_id,))
+
+
+@invalidates_cache
+def replace_etf_data(etf_id, rows, metrics_dict=None):
+    """
+    Replace an ETF's snapshots and metrics in a single transaction.
+
+    rows: list of (date, close_price, distribution) tuples. Existing snapshots
+    are updated in place and only dates missing from rows are deleted.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(SQL_DELETE_ETF_METRICS, (etf_id,))
+        cursor.execute(SQL_PRUNE_SNAPSHOTS, (etf_id, json.dumps([row[0] for row in rows])))
+        _insert_snapshots(cursor, etf_id, rows)
+        if metrics_dict:
+            _insert_metrics(cursor, etf_id, metrics_dict)
@@ -3,12 +3,232 @@ Yahoo Finance data fetching for NAV Erosion Tracker.
 Uses yfinance library to fetch price and distribution data.
 """
 
+import glob
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+import threading
+import time
 import yfinance as yf
 import pandas as pd
+from concurrent.futures import Future
 from datetime import datetime, timedelta
+from functools import lru_cache, wraps
 
+log = logging.getLogger(__name__)
 
-def fetch_etf_data(ticker, start_date=None, end_date=None):
+# Cache lifetimes in seconds
+INFO_CACHE_TTL = 3600
+HISTORY_CACHE_TTL = 600
+
+# Results are also persisted to disk so new processes skip repeat requests;
+# entries expire after the shorter of NAV_CACHE_TTL and the function TTL,
+# and NAV_CACHE_TTL=0 disables the disk cache
+DISK_CACHE_DIR = os.environ.get(
+    'NAV_CACHE_DIR', os.path.join(os.path.dirname(__file__), 'data', 'yf_cache')
+)
+DISK_CACHE_TTL = int(os.environ.get('NAV_CACHE_TTL', 3600))
+
+# yf.download batch size (Yahoo accepts up to 20 symbols per request);
+# batches run one at a time because older yfinance releases keep download
+# state in module globals
+DOWNLOAD_BATCH_SIZE = 20
+
+# Canonical yfinance periods for common month counts; other counts fall
+# back to an explicit start/end date window
+HISTORY_PERIODS = {3: '3mo', 6: '6mo', 12: '1y', 24: '2y', 60: '5y'}
+
+# History columns kept by default; the monthly aggregation only needs these
+HISTORY_COLUMNS = ('Date', 'Close', 'Dividends')
+
+# Failures a Yahoo request can raise: yfinance's own errors, network errors
+# (requests and curl_cffi exceptions are OSErrors) and malformed responses
+FETCH_ERRORS = (yf.exceptions.YFException, OSError, KeyError, ValueError)
+
+# Arguments that carry live objects rather than request parameters
+_UNCACHED_ARGS = ('etf', 'hist')
+
+_caches = []
+
+# Fetches currently running, keyed by (function name, cache key), so
+# concurrent identical calls wait on one Yahoo request instead of each
+# issuing their own
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _ttl_cache(ttl):
+    """
+    Cache successful fetcher results per (ticker, dates) for ttl seconds.
+
+    Concurrent misses for the same key share a single call. Calls that pass
+    hist are pure slicing and bypass the cache; fresh=True skips cached
+    results and stores the new one. Expired entries are evicted whenever a
+    result is stored. DataFrames are copied on the way out so callers can
+    mutate them freely.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        cache = {}
+        lock = threading.Lock()
+        _caches.append((cache, lock))
+
+        @wraps(func)
+        def wrapper(*args, fresh=False, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            if bound.arguments.get('hist') is not None:
+                return func(*args, **kwargs)
+
+            key = tuple(
+                str(value).upper() if name == 'ticker'
+                else tuple(value) if isinstance(value, list)
+                else value
+                for name, value in bound.arguments.items()
+                if name not in _UNCACHED_ARGS
+            )
+            with lock:
+                entry = cache.get(key)
+            if not fresh and entry is not None and entry[1] > time.monotonic():
+                result = entry[0]
+            else:
+                result = _coalesced_call(
+                    (func.__name__, key), func, cache, lock, ttl, args, kwargs, fresh
+                )
+
+            return {
+                name: value.copy() if isinstance(value, pd.DataFrame) else value
+                for name, value in result.items()
+            }
+        return wrapper
+    return decorator
+
+
+def _coalesced_call(inflight_key, func, cache, lock, ttl, args, kwargs, fresh=False):
+    """Run func once per inflight_key at a time; concurrent callers share its result."""
+    with _inflight_lock:
+        future = _inflight.get(inflight_key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _inflight[inflight_key] = future
+
+    if not owner:
+        return future.result()
+
+    try:
+        result = None if fresh else _disk_cache_get(inflight_key)
+        if result is None:
+            result = func(*args, **kwargs)
+            if result['success']:
+                _disk_cache_set(inflight_key, result, ttl)
+        if result['success']:
+            now = time.monotonic()
+            with lock:
+                for expired in [key for key, (_, expires) in cache.items() if expires <= now]:
+                    del cache[expired]
+                cache[inflight_key[1]] = (result, now + ttl)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(inflight_key, None)
+
+
+def _disk_cache_path(inflight_key):
+    """File holding the persisted result for a (function name, cache key) pair."""
+    name, key = inflight_key
+    digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+    return os.path.join(DISK_CACHE_DIR, f'{name}-{digest}.pkl')
+
+
+def _disk_cache_get(inflight_key):
+    """Load an unexpired result from the disk cache, or None; deletes expired entries."""
+    if DISK_CACHE_TTL <= 0:
+        return None
+    path = _disk_cache_path(inflight_key)
+    try:
+        with open(path, 'rb') as f:
+            expires, result = pickle.load(f)
+    except Exception:  # Missing, unreadable or corrupt entries are misses
+        return None
+    if expires > time.time():
+        return result
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    return None
+
+
+def _disk_cache_set(inflight_key, result, ttl):
+    """
+    Persist a successful result; write failures only cost a future miss.
+
+    Entries are never valid longer than DISK_CACHE_TTL after they are
+    written, so files older than that are swept on each write.
+    """
+    if DISK_CACHE_TTL <= 0:
+        return
+    path = _disk_cache_path(inflight_key)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        os.makedirs(DISK_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((time.time() + min(ttl, DISK_CACHE_TTL), result), f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+    cutoff = time.time() - DISK_CACHE_TTL
+    for stale_path in glob.glob(os.path.join(DISK_CACHE_DIR, '*.pkl')):
+        try:
+            if os.path.getmtime(stale_path) < cutoff:
+                os.remove(stale_path)
+        except OSError:
+            pass
+
+
+def clear_cache():
+    """Drop all cached Yahoo Finance results, in memory and on disk."""
+    for cache, lock in _caches:
+        with lock:
+            cache.clear()
+    _fetch_long_name.cache_clear()
+    for path in glob.glob(os.path.join(DISK_CACHE_DIR, '*.pkl')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _date_bounds(start_date=None, end_date=None, days=365):
+    """Fill in missing 'YYYY-MM-DD' bounds from one clock read (start: `days` ago)."""
+    if start_date and end_date:
+        return start_date, end_date
+    now = datetime.now()
+    return (
+        start_date or (now - timedelta(days=days)).strftime('%Y-%m-%d'),
+        end_date or now.strftime('%Y-%m-%d')
+    )
+
+
+def _request_window(start_date, end_date, period):
+    """yfinance history arguments: explicit dates if any are given, else a period."""
+    if start_date or end_date:
+        start_date, end_date = _date_bounds(start_date, end_date)
+        return {'start': start_date, 'end': end_date}
+    return {'period': period or '1y'}
+
+
+@_ttl_cache(HISTORY_CACHE_TTL)
+def fetch_etf_data(ticker, start_date=None, end_date=None, etf=None, period=None,
+                   columns=HISTORY_COLUMNS):
     """
     Fetch price history for an ETF.
 
@@ -16,18 +236,22 @@ def fetch_etf_data(ticker, start_date=None, end_date=None):
         ticker: Yahoo Finance ticker (e.g., 'HMAX.TO')
         start_date: Start date string 'YYYY-MM-DD' (default: 1 year ago)
         end_date: End date string 'YYYY-MM-DD' (default: today)
+        etf: Optional yf.Ticker to reuse instead of creating a new one
+        period: yfinance period string (e.g. '1y') used when neither date
+                is given (default: '1y')
+        columns: History columns to keep (default: Date, Close, Dividends)
 
     Returns:
-        dict with 'success', 'data' (DataFrame), and 'error' keys
+        dict with 'success', 'data' (DataFrame), and 'error' keys;
+        the Date column holds naive datetime64 exchange-local dates.
+        Close is the unadjusted close so distributions are not folded back
+        into the price, and the Dividends column carries the payouts.
     """
-    if not start_date:
-        start_date = (datetime.now() - timedelta(days=365)).strftime('%Y-%m-%d')
-    if not end_date:
-        end_date = datetime.now().strftime('%Y-%m-%d')
+    window = _request_window(start_date, end_date, period)
 
     try:
-        etf = yf.Ticker(ticker)
-        hist = etf.history(start=start_date, end=end_date)
+        etf = etf or yf.Ticker(ticker)
+        hist = etf.history(actions=True, auto_adjust=False, **window)
 
         if hist.empty:
             return {
@@ -36,9 +260,11 @@ def fetch_etf_data(ticker, start_date=None, end_date=None):
                 'error': f'No data found for ticker {ticker}'
             }
 
-        # Reset index to have Date as a column
+        # Reset index to have Date as a column, keeping only the requested
+        # columns so unused OHLC/volume data is not carried downstream
         hist = hist.reset_index()
-        hist['Date'] = pd.to_datetime(hist['Date']).dt.strftime('%Y-%m-%d')
+        hist = hist[[column for column in columns if column in hist.columns]]
+        hist['Date'] = hist['Date'].dt.tz_localize(None)
 
         return {
             'success': True,
@@ -46,7 +272,8 @@ def fetch_etf_data(ticker, start_date=None, end_date=None):
             'error': None
         }
 
-    except Exception as e:
+    except FETCH_ERRORS as e:
+        log.warning('price fetch for %s failed: %s', ticker, e)
         return {
             'success': False,
             'data': None,
@@ -54,7 +281,8 @@ def fetch_etf_data(ticker, start_date=None, end_date=None):
         }
 
 
-def fetch_distributions(ticker, start_date=None, end_date=None):
+@_ttl_cache(HISTORY_CACHE_TTL)
+def fetch_distributions(ticker, start_date=None, end_date=None, etf=None, hist=None):
     """
     Fetch dividend/distribution history for an ETF.
 
@@ -62,33 +290,50 @@ def fetch_distributions(ticker, start_date=None, end_date=None):
         ticker: Yahoo Finance ticker
         start_date: Start date string 'YYYY-MM-DD'
         end_date: End date string 'YYYY-MM-DD'
+        etf: Optional yf.Ticker to reuse instead of creating a new one
+        hist: Optional price history from fetch_etf_data; its Dividends
+              column is used instead of a separate dividends request
 
     Returns:
-        dict with 'success', 'data' (DataFrame), and 'error' keys
+        dict with 'success', 'data' (DataFrame), and 'error' keys;
+        the Date column holds naive datetime64 exchange-local dates
     """
-    if not start_date:
-        start_date = (datetime.now() - timedelta(days=365)).strftime('%Y-%m-%d')
-    if not end_date:
-        end_date = datetime.now().strftime('%Y-%m-%d')
-
     try:
-        etf = yf.Ticker(ticker)
+        if hist is not None and 'Dividends' in hist.columns:
+            df = hist.loc[hist['Dividends'] > 0, ['Date', 'Dividends']]
+            df = df.rename(columns={'Dividends': 'Dividend'}).reset_index(drop=True)
+            return {
+                'success': True,
+                'data': df,
+                'error': None
+            }
+
+        start_date, end_date = _date_bounds(start_date, end_date)
+
+        etf = etf or yf.Ticker(ticker)
         dividends = etf.dividends
 
         if dividends.empty:
             return {
                 'success': True,
-                'data': pd.DataFrame(columns=['Date', 'Dividend']),
+                'data': pd.DataFrame({
+                    'Date': pd.Series(dtype='datetime64[ns]'),
+                    'Dividend': pd.Series(dtype='float64')
+                }),
                 'error': None
             }
 
-        # Filter by date range
-        dividends = dividends.loc[start_date:end_date]
+        # Filter by date range with a boolean mask on exchange-local dates,
+        # which needs no sorted index; end_date is inclusive of the whole day
+        dates = dividends.index.tz_localize(None)
+        mask = (dates >= pd.Timestamp(start_date)) & (
+            dates < pd.Timestamp(end_date) + pd.Timedelta(days=1)
+        )
 
-        # Convert to DataFrame with Date column
-        df = dividends.reset_index()
-        df.columns = ['Date', 'Dividend']
-        df['Date'] = pd.to_datetime(df['Date']).dt.strftime('%Y-%m-%d')
+        df = pd.DataFrame({
+            'Date': dates[mask],
+            'Dividend': dividends.to_numpy()[mask]
+        })
 
         return {
             'success': True,
@@ -96,7 +341,8 @@ def fetch_distributions(ticker, start_date=None, end_date=None):
             'error': None
         }
 
-    except Exception as e:
+    except FETCH_ERRORS as e:
+        log.warning('distribution fetch for %s failed: %s', ticker, e)
         return {
             'success': False,
             'data': None,
@@ -104,40 +350,39 @@ def fetch_distributions(ticker, start_date=None, end_date=None):
         }
 
 
-def fetch_etf_info(ticker):
+@_ttl_cache(INFO_CACHE_TTL)
+def fetch_etf_info(ticker, etf=None, include_name=True):
     """
     Fetch basic info about an ETF to validate the ticker.
 
+    Validation and currency use the lightweight fast_info endpoint; the full
+    quoteSummary scrape only runs when include_name is set. Pass etf to
+    reuse an existing yf.Ticker.
+
     Returns:
         dict with 'success', 'name', 'currency', and 'error' keys
     """
     try:
-        etf = yf.Ticker(ticker)
-        info = etf.info
-
-        # Check if we got valid data
-        if not info or info.get('regularMarketPrice') is None:
-            # Try to get history as a fallback check
-            hist = etf.history(period='5d')
-            if hist.empty:
-                return {
-                    'success': False,
-                    'name': None,
-                    'currency': None,
-                    'error': f'Invalid ticker: {ticker}'
-                }
-
-        name = info.get('shortName') or info.get('longName') or ticker
-        currency = info.get('currency', 'USD')
+        etf = etf or yf.Ticker(ticker)
+        fast_info = etf.fast_info
+
+        if fast_info.get('last_price') is None:
+            return {
+                'success': False,
+                'name': None,
+                'currency': None,
+                'error': f'Invalid ticker: {ticker}'
+            }
 
         return {
             'success': True,
-            'name': name,
-            'currency': currency,
+            'name': _fetch_name(ticker) if include_name else None,
+            'currency': fast_info.get('currency') or 'USD',
             'error': None
         }
 
-    except Exception as e:
+    except FETCH_ERRORS as e:
+        log.warning('info fetch for %s failed: %s', ticker, e)
         return {
             'success': False,
             'name': None,
@@ -146,43 +391,175 @@ def fetch_etf_info(ticker):
         }
 
 
-def fetch_all_data(ticker, months=12):
+def _fetch_name(ticker):
+    """Human-readable fund name, falling back to the ticker if unavailable."""
+    try:
+        return _fetch_long_name(ticker)
+    except FETCH_ERRORS:
+        return ticker
+
+
+@lru_cache(maxsize=1024)
+def _fetch_long_name(ticker):
+    """Fund name from the full info scrape; failures raise and are not cached."""
+    info = yf.Ticker(ticker).get_info()
+    return info.get('shortName') or info.get('longName') or ticker
+
+
+def fetch_many_etf_data(tickers, start_date=None, end_date=None, period=None,
+                        columns=HISTORY_COLUMNS):
+    """
+    Fetch price history for many ETFs with batched yf.download calls.
+
+    Tickers are split into batches of DOWNLOAD_BATCH_SIZE which are
+    downloaded in turn. Dates, period and columns behave as in
+    fetch_etf_data.
+
+    Returns:
+        dict mapping each ticker, as passed in, to the same result shape
+        as fetch_etf_data
+    """
+    window = _request_window(start_date, end_date, period)
+
+    # yf.download upper-cases symbols, so batch and split on upper case
+    symbols = list(dict.fromkeys(str(ticker).upper() for ticker in tickers))
+
+    by_symbol = {}
+    for i in range(0, len(symbols), DOWNLOAD_BATCH_SIZE):
+        by_symbol.update(_download_batch(symbols[i:i + DOWNLOAD_BATCH_SIZE], window, columns))
+    return {ticker: by_symbol[str(ticker).upper()] for ticker in tickers}
+
+
+def _download_batch(tickers, window, columns):
+    """Download one batch of tickers and split the result per ticker."""
+    try:
+        df = yf.download(
+            tickers, group_by='ticker', actions=True, auto_adjust=False,
+            threads=True, progress=False, **window
+        )
+    except FETCH_ERRORS as e:
+        log.warning('batch download for %s failed: %s', ', '.join(tickers), e)
+        return {
+            ticker: {'success': False, 'data': None, 'error': str(e)}
+            for ticker in tickers
+        }
+
+    # Older yfinance releases return flat columns for a single ticker
+    if df is None or df.empty:
+        frames = {}
+    elif isinstance(df.columns, pd.MultiIndex):
+        frames = {ticker: df[ticker] for ticker in set(df.columns.get_level_values(0))}
+    else:
+        frames = {tickers[0]: df} if len(tickers) == 1 else {}
+
+    results = {}
+    for ticker in tickers:
+        hist = frames[ticker].dropna(subset=['Close']) if ticker in frames else None
+        if hist is None or hist.empty:
+            results[ticker] = {
+                'success': False,
+                'data': None,
+                'error': f'No data found for ticker {ticker}'
+            }
+            continue
+
+        hist = hist.rename_axis('Date').reset_index()
+        hist.columns.name = None
+        hist = hist[[column for column in columns if column in hist.columns]]
+        hist['Date'] = hist['Date'].dt.tz_localize(None)
+        results[ticker] = {
+            'success': True,
+            'data': hist,
+            'error': None
+        }
+    return results
+
+
+def _history_window(months):
+    """
+    History arguments covering the last `months` months.
+
+    Common month counts map to a canonical yfinance period; anything else
+    becomes an explicit start/end date window.
+    """
+    if months in HISTORY_PERIODS:
+        return {'period': HISTORY_PERIODS[months]}
+    start_date, end_date = _date_bounds(days=months * 31)
+    return {'start_date': start_date, 'end_date': end_date}
+
+
+def fetch_all_data(ticker, months=12, fresh=False):
     """
     Fetch both price and distribution data for an ETF.
 
     Args:
         ticker: Yahoo Finance ticker
         months: Number of months of history to fetch
+        fresh: Skip cached prices and fetch from Yahoo Finance
 
     Returns:
         dict with price data, distribution data, and any errors
     """
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=months * 31)
-
-    start_str = start_date.strftime('%Y-%m-%d')
-    end_str = end_date.strftime('%Y-%m-%d')
+    window = _history_window(months)
 
-    price_result = fetch_etf_data(ticker, start_str, end_str)
-    dist_result = fetch_distributions(ticker, start_str, end_str)
+    # The price history carries a Dividends column, so distributions are
+    # sliced from it rather than fetched with a second request; without
+    # prices there is nothing to aggregate, so nothing else is fetched
+    price_result = fetch_etf_data(ticker, fresh=fresh, **window)
+    if price_result['success']:
+        dist_result = fetch_distributions(ticker, hist=price_result['data'])
+    else:
+        dist_result = {'success': False, 'data': None, 'error': price_result['error']}
 
     return {
         'prices': price_result,
         'distributions': dist_result,
         'ticker': ticker,
-        'start_date': start_str,
-        'end_date': end_str
+        'start_date': window.get('start_date'),
+        'end_date': window.get('end_date'),
+        'period': window.get('period')
     }
 
 
-def get_monthly_data(ticker, months=12):
+def get_monthly_data(ticker, months=12, fresh=False):
     """
     Get monthly closing prices and distributions.
 
-    Returns data aggregated by month for simpler analysis.
+    Returns data aggregated by month for simpler analysis. Pass fresh=True
+    to bypass cached Yahoo Finance results.
     """
-    result = fetch_all_data(ticker, months)
+    return _aggregate_monthly(fetch_all_data(ticker, months, fresh))
 
+
+def get_monthly_data_many(tickers, months=12):
+    """
+    Get monthly data for many tickers using batched price downloads.
+
+    Returns:
+        dict mapping each ticker to the same result shape as get_monthly_data
+    """
+    window = _history_window(months)
+    price_results = fetch_many_etf_data(tickers, **window)
+
+    monthly = {}
+    for ticker, price_result in price_results.items():
+        if price_result['success']:
+            dist_result = fetch_distributions(ticker, hist=price_result['data'])
+        else:
+            dist_result = {'success': False, 'data': None, 'error': price_result['error']}
+        monthly[ticker] = _aggregate_monthly({
+            'prices': price_result,
+            'distributions': dist_result,
+            'ticker': ticker,
+            'start_date': window.get('start_date'),
+            'end_date': window.get('end_date'),
+            'period': window.get('period')
+        })
+    return monthly
+
+
+def _aggregate_monthly(result):
+    """Aggregate a fetch_all_data-style result into monthly records."""
     if not result['prices']['success']:
         return {
             'success': False,
@@ -192,36 +569,31 @@ def get_monthly_data(ticker, months=12):
 
     prices_df = result['prices']['data']
 
-    # Convert to datetime for grouping
-    prices_df['DateDT'] = pd.to_datetime(prices_df['Date'])
-    prices_df['YearMonth'] = prices_df['DateDT'].dt.to_period('M')
-
-    # Get last close price of each month
-    monthly_prices = prices_df.groupby('YearMonth').agg({
-        'Close': 'last',
-        'Date': 'last'
-    }).reset_index()
-
-    # Process distributions if available
-    monthly_dist = {}
+    # Last trading date and close price of each month on a contiguous
+    # month-end index; months without trading carry the previous close
+    # forward and are dated at month end so every month has one row
+    monthly_prices = (
+        prices_df.set_index('Date', drop=False)[['Date', 'Close']]
+        .resample('ME').last()
+    )
+    monthly_prices['Close'] = monthly_prices['Close'].ffill()
+    monthly_prices['Date'] = monthly_prices['Date'].fillna(monthly_prices.index.to_series())
+
+    # Sum distributions per month, if available
+    monthly_dist = pd.Series(0.0, index=monthly_prices.index)
     if result['distributions']['success'] and not result['distributions']['data'].empty:
         dist_df = result['distributions']['data']
-        dist_df['DateDT'] = pd.to_datetime(dist_df['Date'])
-        dist_df['YearMonth'] = dist_df['DateDT'].dt.to_period('M')
-
-        dist_by_month = dist_df.groupby('YearMonth')['Dividend'].sum()
-        monthly_dist = dist_by_month.to_dict()
-
-    # Combine into monthly data
-    monthly_data = []
-    for _, row in monthly_prices.iterrows():
-        ym = row['YearMonth']
-        monthly_data.append({
-            'year_month': str(ym),
-            'date': row['Date'],
-            'close_price': float(row['Close']),
-            'distribution': float(monthly_dist.get(ym, 0))
-        })
+        dist_by_month = dist_df.set_index('Date')['Dividend'].resample('ME').sum()
+        monthly_dist = dist_by_month.reindex(monthly_prices.index, fill_value=0.0)
+
+    # Combine into monthly data with column operations instead of a row loop;
+    # dates stay datetime64 until here so only one string per month is built
+    monthly_data = pd.DataFrame({
+        'year_month': monthly_prices.index.strftime('%Y-%m'),
+        'date': monthly_prices['Date'].dt.strftime('%Y-%m-%d'),
+        'close_price': monthly_prices['Close'].astype('float64'),
+        'distribution': monthly_dist.astype('float64')
+    }).to_dict(orient='records')
 
     return {
         'success': True,